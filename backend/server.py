@@ -1,30 +1,30 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form
-from bson import ObjectId
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Query
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import WriteConcern
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import uuid
 from datetime import datetime, timezone
-import PyPDF2
-from PIL import Image
-import base64
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
 import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.responses import FileResponse
 import aiofiles
 import tempfile
 import json
+import hashlib
+import re
+import secrets
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
 try:
     from emergent_llm.llm_chats import LlmChat
     from emergent_llm.schemas import UserMessage, FileContentWithMimeType
@@ -32,6 +32,13 @@ except ImportError:
     
     pass 
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -40,26 +47,249 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Write concern leggero per i contenuti derivati (riassunti, schemi, cache LLM):
+# sono rigenerabili, quindi basta la conferma del primary senza journal
+derived_write_concern = WriteConcern(w=1, j=False)
+derived_documents = db.documents.with_options(write_concern=derived_write_concern)
+
+# Origini consentite per CORS
+CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
+
 # Emergent LLM Key
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
 
+# Modello Gemini usato da tutte le chiamate LLM
+LLM_PROVIDER = "gemini"
+LLM_MODEL = "gemini-2.0-flash"
+
+# Cache delle risposte LLM (TTL in secondi, default 7 giorni)
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+CHAT_SYSTEM_MESSAGE = "Sei un assistente AI specializzato nell'aiutare gli utenti con documenti e contenuti. Puoi rispondere a domande, suggerire modifiche, e fornire supporto."
+
+# Riassunto map-reduce dei documenti lunghi (~8k token per sezione, ~200 di sovrapposizione)
+SUMMARY_CHUNK_CHARS = 32000
+SUMMARY_CHUNK_OVERLAP_CHARS = 800
+SUMMARY_MAX_PARALLEL_CHUNKS = 8
+# Limiti della riduzione: al massimo 3 passate, ognuna deve accorciare il testo di almeno il 25%
+SUMMARY_MAX_REDUCE_ROUNDS = 3
+SUMMARY_MIN_REDUCE_RATIO = 0.75
+SUMMARY_CHUNK_INSTRUCTIONS = (
+    "Questa è una sezione di un documento più lungo. Crea un riassunto dettagliato della sezione, "
+    "mantenendo tutti i dati, le cifre e i punti chiave e l'ordine originale."
+)
+
+# Scrittura a blocchi dei messaggi di chat
+CHAT_WRITE_BATCH_SIZE = 50
+CHAT_WRITE_INTERVAL_SECONDS = 0.2
+
+# Micro-batching delle richieste LLM concorrenti (disattivato di default: aggiunge latenza)
+LLM_BATCHING_ENABLED = os.environ.get('LLM_BATCHING_ENABLED', 'false').lower() == 'true'
+LLM_BATCH_MAX_SIZE = 8
+LLM_BATCH_WINDOW_SECONDS = 0.25
+# Solo i prompt brevi vengono raggruppati: quelli con il documento completo vanno inviati da soli
+LLM_BATCH_MAX_PROMPT_CHARS = 4000
+
+# Upload limits
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024  # 100MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Utility function to prepare documents for MongoDB
-def prepare_for_mongo(data):
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, datetime):
-                data[key] = value.isoformat()
-            elif isinstance(value, dict):
-                data[key] = prepare_for_mongo(value)
-            elif isinstance(value, list):
-                data[key] = [prepare_for_mongo(item) if isinstance(item, dict) else item for item in value]
-    return data
+# Cache delle risposte LLM
+class LLMCache:
+    """Cache esatta delle risposte LLM su MongoDB, indicizzata per hash del prompt"""
+    
+    def __init__(self, collection):
+        self.collection = collection
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(**params) -> str:
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            entry = await self.collection.find_one({"key": key}, {"_id": 0, "response": 1})
+        except Exception as e:
+            logger.warning("LLM cache lookup failed: %s", e)
+            entry = None
+        
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["response"]
+    
+    async def set(self, key: str, response: str):
+        try:
+            await self.collection.update_one(
+                {"key": key},
+                {"$set": {"response": response, "created_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning("LLM cache write failed: %s", e)
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0
+        }
+
+llm_cache = LLMCache(db.llm_cache.with_options(write_concern=derived_write_concern))
+
+# Micro-batching delle richieste LLM. I tag dei delimitatori contengono un nonce casuale per
+# batch, così il contenuto delle richieste non può imitarli
+BATCH_SYSTEM_MESSAGE = (
+    "Riceverai più richieste indipendenti, ognuna con le proprie istruzioni. "
+    "Rispondi a ciascuna separatamente, racchiudendo ogni risposta tra "
+    "<{tag} n=\"N\"> e </{tag}>, dove N è il numero della richiesta."
+)
+
+class LLMBatcher:
+    """Raggruppa le richieste LLM che arrivano entro una breve finestra in un'unica chiamata"""
+    
+    def __init__(self, max_batch_size: int, window_seconds: float):
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dispatches = set()
+    
+    def start(self):
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+    
+    async def submit(self, system_message: str, text: str) -> Tuple[str, bool]:
+        """Ritorna la risposta e se è stata estratta da una chiamata raggruppata"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((system_message, text, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Il batch viene inviato in background mentre si raccoglie il successivo
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, batch: list):
+        answers = {}
+        if len(batch) > 1:
+            nonce = secrets.token_hex(8)
+            request_tag, answer_tag = f"richiesta-{nonce}", f"risposta-{nonce}"
+            prompt = "\n\n".join(
+                f"<{request_tag} n=\"{n}\">\n<istruzioni>\n{system_message}\n</istruzioni>\n{text}\n</{request_tag}>"
+                for n, (system_message, text, _) in enumerate(batch, start=1)
+            )
+            answer_pattern = re.compile(rf'<{answer_tag} n="(\d+)">(.*?)</{answer_tag}>', re.DOTALL)
+            try:
+                response = await send_message(BATCH_SYSTEM_MESSAGE.format(tag=answer_tag), prompt)
+                answers = {int(n): answer.strip() for n, answer in answer_pattern.findall(response)}
+            except Exception as e:
+                logger.warning("LLM batch of %s failed, retrying individually: %s", len(batch), e)
+        
+        # Le richieste senza risposta nel batch vengono inviate singolarmente
+        await asyncio.gather(*[
+            self._resolve(future, answers.get(n), system_message, text)
+            for n, (system_message, text, future) in enumerate(batch, start=1)
+        ])
+    
+    async def _resolve(self, future: asyncio.Future, answer: Optional[str], system_message: str, text: str):
+        if future.done():
+            return
+        if answer:
+            future.set_result((answer, True))
+            return
+        try:
+            future.set_result((await send_message(system_message, text), False))
+        except Exception as e:
+            future.set_exception(e)
+
+llm_batcher = LLMBatcher(LLM_BATCH_MAX_SIZE, LLM_BATCH_WINDOW_SECONDS)
+
+# Scrittura asincrona dei messaggi di chat
+class ChatMessageWriter:
+    """Accoda i messaggi di chat e li salva su MongoDB con insert_many periodici"""
+    
+    def __init__(self, collection, max_batch_size: int, flush_interval: float):
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        # None segnala la fine: i messaggi già in coda vengono scritti prima di uscire
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+    
+    def submit(self, message: dict):
+        self.queue.put_nowait(message)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            
+            buffer = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(buffer) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                buffer.append(item)
+            
+            try:
+                await self.collection.insert_many(buffer, ordered=False)
+            except Exception:
+                logger.exception("Error saving %s chat messages", len(buffer))
+
+chat_message_writer = ChatMessageWriter(db.chat_messages, CHAT_WRITE_BATCH_SIZE, CHAT_WRITE_INTERVAL_SECONDS)
 
 # Models
 class DocumentUpload(BaseModel):
@@ -96,26 +326,117 @@ class ChatRequest(BaseModel):
     message: str
     context: Optional[str] = None  # Testo del documento per contesto
 
+# Prompt precalcolati per tutte le combinazioni di tipo e accuratezza
+SUMMARY_LENGTH_INSTRUCTIONS = {
+    "breve": "Crea un riassunto molto conciso di massimo 200 parole",
+    "medio": "Crea un riassunto di lunghezza media tra 300-500 parole",
+    "dettagliato": "Crea un riassunto dettagliato e completo di 600-800 parole"
+}
+
+SUMMARY_ACCURACY_INSTRUCTIONS = {
+    "standard": "Mantieni le informazioni principali",
+    "alta": "Mantieni tutti i dettagli importanti, dati, cifre e punti chiave senza omettere nulla di rilevante"
+}
+
+SCHEMA_TYPE_INSTRUCTIONS = {
+    "brainstorming": "Crea una mappa mentale in formato testuale con le idee principali, concetti chiave e collegamenti. Usa simboli, frecce e indentazione per mostrare le relazioni.",
+    "cascata": "Crea uno schema a cascata/flow chart che mostri la sequenza logica, i processi e i collegamenti gerarchici del contenuto. Usa frecce e livelli per mostrare il flusso."
+}
+
+def _render_summary_instructions(summary_type: str, accuracy_level: str) -> str:
+    return f"""
+Sei un esperto nella creazione di riassunti. {SUMMARY_LENGTH_INSTRUCTIONS[summary_type]}.
+{SUMMARY_ACCURACY_INSTRUCTIONS[accuracy_level]}.
+
+Il riassunto deve:
+- Catturare tutti i punti principali del documento
+- Mantenere la logica e la struttura del testo originale
+- Essere chiaro e ben organizzato
+- Includere tutte le sezioni importanti del documento originale
+"""
+
+def _render_schema_instructions(schema_type: str) -> str:
+    return f"""
+Sei un esperto nella creazione di schemi e mappe mentali. {SCHEMA_TYPE_INSTRUCTIONS[schema_type]}
+
+Lo schema deve:
+- Essere visivamente chiaro e ben strutturato
+- Mostrare tutte le relazioni importanti
+- Usare simboli ASCII per migliorare la leggibilità
+- Essere esportabile e comprensibile
+"""
+
+SUMMARY_INSTRUCTIONS = {
+    (summary_type, accuracy_level): _render_summary_instructions(summary_type, accuracy_level)
+    for summary_type in SUMMARY_LENGTH_INSTRUCTIONS
+    for accuracy_level in SUMMARY_ACCURACY_INSTRUCTIONS
+}
+
+SCHEMA_INSTRUCTIONS = {
+    schema_type: _render_schema_instructions(schema_type)
+    for schema_type in SCHEMA_TYPE_INSTRUCTIONS
+}
+
 # Helper functions
-async def extract_text_from_pdf(file_content: bytes) -> str:
+def _sync_extract_pdf(file_path: str) -> str:
+    import fitz
+    
+    # PyMuPDF (MuPDF in C) con i flag di testo predefiniti
+    doc = fitz.open(file_path, filetype="pdf")
+    try:
+        # Nessun font nelle prime pagine: PDF scansionato, si passa direttamente a Gemini
+        if not any(doc[page_num].get_fonts() for page_num in range(min(3, len(doc)))):
+            return ""
+        
+        text = "\n".join(
+            page.get_text("text")
+            for page in doc
+        )
+    finally:
+        doc.close()
+    return text.strip()
+
+async def extract_text_from_pdf(file_path: str) -> str:
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n"
-        return text.strip()
+        # Lavoro CPU-bound: eseguito nel thread pool per non bloccare l'event loop
+        return await asyncio.to_thread(_sync_extract_pdf, file_path)
+    except Exception:
+        logger.exception("Error extracting PDF text")
+        return ""
+
+def _sync_ocr_image(file_path: str) -> str:
+    from PIL import Image
+    
+    with Image.open(file_path) as img:
+        return pytesseract.image_to_string(img, lang="ita+eng").strip()
+
+async def extract_text_with_ocr(file_path: str) -> str:
+    """OCR locale con Tesseract: evita la chiamata a Gemini per le immagini con testo leggibile"""
+    if pytesseract is None:
+        return ""
+    try:
+        return await asyncio.to_thread(_sync_ocr_image, file_path)
     except Exception as e:
-        logging.error(f"Error extracting PDF text: {e}")
+        logger.warning("Local OCR failed, falling back to Gemini: %s", e)
         return ""
 
+def create_llm_chat(system_message: str) -> "LlmChat":
+    """Unico punto di creazione dei client LLM.
+    
+    LlmChat conserva la cronologia dei messaggi, quindi non può essere condiviso tra
+    richieste diverse: le chiamate one-shot usano sempre una sessione nuova.
+    """
+    return LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=str(uuid.uuid4()),
+        system_message=system_message
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+
 async def extract_text_with_gemini(file_path: str, mime_type: str) -> str:
     try:
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message="Sei un esperto nell'estrazione di testo da documenti. Estrai tutto il contenuto testuale dal documento fornito, mantenendo la struttura e l'ordine originale. Non omettere nessuna parte del contenuto."
-        ).with_model("gemini", "gemini-2.0-flash")
+        chat = create_llm_chat(
+            "Sei un esperto nell'estrazione di testo da documenti. Estrai tutto il contenuto testuale dal documento fornito, mantenendo la struttura e l'ordine originale. Non omettere nessuna parte del contenuto."
+        )
         
         file_content = FileContentWithMimeType(
             file_path=file_path,
@@ -130,85 +451,140 @@ async def extract_text_with_gemini(file_path: str, mime_type: str) -> str:
         response = await chat.send_message(user_message)
         return response
     except Exception as e:
-        logging.error(f"Error extracting text with Gemini: {e}")
+        logger.exception("Error extracting text with Gemini")
         raise HTTPException(status_code=500, detail=f"Errore nell'estrazione del testo: {str(e)}")
 
+async def send_message(system_message: str, text: str) -> str:
+    chat = create_llm_chat(system_message)
+    return await chat.send_message(UserMessage(text=text))
+
+async def send_message_cached(system_message: str, text: str, batchable: bool = True, **params) -> str:
+    """Invia un messaggio a Gemini riusando la risposta in cache se il prompt è già stato visto.
+    
+    Con batchable=False la richiesta non viene mai raggruppata (testo scritto dall'utente).
+    """
+    key = LLMCache.make_key(
+        model=LLM_MODEL,
+        system=system_message,
+        text=text,
+        **params
+    )
+    cached = await llm_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    if batchable and LLM_BATCHING_ENABLED and len(system_message) + len(text) <= LLM_BATCH_MAX_PROMPT_CHARS:
+        response, batched = await llm_batcher.submit(system_message, text)
+        # Le risposte estratte da un batch dipendono dalle altre richieste: non vanno in cache
+        if batched:
+            return response
+    else:
+        response = await send_message(system_message, text)
+    await llm_cache.set(key, response)
+    return response
+
+def split_text_into_chunks(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """Divide il testo in finestre sovrapposte, tagliando preferibilmente a fine riga o tra parole"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = text.rfind("\n", start + chunk_size // 2, end)
+            if cut == -1:
+                cut = text.rfind(" ", start + chunk_size // 2, end)
+            if cut != -1:
+                end = cut
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = end - overlap
+    return chunks
+
+async def summarize_chunk(chunk: str, semaphore: asyncio.Semaphore) -> str:
+    # Prompt indipendente da tipo e accuratezza: i riassunti parziali restano in cache tra le varianti
+    async with semaphore:
+        return await send_message_cached(
+            SUMMARY_CHUNK_INSTRUCTIONS,
+            chunk,
+            endpoint="summary_chunk"
+        )
+
+async def reduce_text_by_sections(text: str) -> str:
+    """Riassume il testo per sezioni in parallelo finché non rientra in una singola finestra.
+    
+    Si ferma dopo SUMMARY_MAX_REDUCE_ROUNDS passate o quando una passata non accorcia
+    abbastanza il testo: il riassunto finale riceve allora il testo ridotto fin lì.
+    """
+    semaphore = asyncio.Semaphore(SUMMARY_MAX_PARALLEL_CHUNKS)
+    for _ in range(SUMMARY_MAX_REDUCE_ROUNDS):
+        if len(text) <= SUMMARY_CHUNK_CHARS:
+            break
+        chunks = split_text_into_chunks(text, SUMMARY_CHUNK_CHARS, SUMMARY_CHUNK_OVERLAP_CHARS)
+        tasks = [asyncio.create_task(summarize_chunk(chunk, semaphore)) for chunk in chunks]
+        try:
+            partials = await asyncio.gather(*tasks)
+        except BaseException:
+            # Al primo errore (o se la richiesta viene annullata) le altre sezioni non servono più
+            for task in tasks:
+                task.cancel()
+            raise
+        reduced = "\n\n".join(
+            f"Sezione {n}:\n{partial}" for n, partial in enumerate(partials, start=1)
+        )
+        shrunk = len(reduced) <= len(text) * SUMMARY_MIN_REDUCE_RATIO
+        text = reduced
+        if not shrunk:
+            logger.warning("Section summaries did not shrink the text enough, stopping at %s chars", len(text))
+            break
+    return text
+
 async def generate_summary_with_gemini(text: str, summary_type: str, accuracy_level: str) -> str:
     try:
-        # Configurazione prompt basata sul tipo di riassunto
-        length_instructions = {
-            "breve": "Crea un riassunto molto conciso di massimo 200 parole",
-            "medio": "Crea un riassunto di lunghezza media tra 300-500 parole",
-            "dettagliato": "Crea un riassunto dettagliato e completo di 600-800 parole"
-        }
+        instructions = SUMMARY_INSTRUCTIONS.get((summary_type, accuracy_level)) or SUMMARY_INSTRUCTIONS[(
+            summary_type if summary_type in SUMMARY_LENGTH_INSTRUCTIONS else "medio",
+            accuracy_level if accuracy_level in SUMMARY_ACCURACY_INSTRUCTIONS else "standard"
+        )]
         
-        accuracy_instructions = {
-            "standard": "Mantieni le informazioni principali",
-            "alta": "Mantieni tutti i dettagli importanti, dati, cifre e punti chiave senza omettere nulla di rilevante"
-        }
+        # Documenti lunghi: riassunto map-reduce per sezioni, poi riassunto finale
+        if len(text) > SUMMARY_CHUNK_CHARS:
+            text = await reduce_text_by_sections(text)
+            instructions += "Il documento fornito è composto dai riassunti delle sue sezioni, in ordine.\n"
         
-        system_message = f"""
-Sei un esperto nella creazione di riassunti. {length_instructions.get(summary_type, length_instructions['medio'])}.
-{accuracy_instructions.get(accuracy_level, accuracy_instructions['standard'])}.
-
-Il riassunto deve:
-- Catturare tutti i punti principali del documento
-- Mantenere la logica e la struttura del testo originale
-- Essere chiaro e ben organizzato
-- Includere tutte le sezioni importanti del documento originale
-"""
-        
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message=system_message
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        user_message = UserMessage(
-            text=f"Crea un riassunto del seguente testo:\n\n{text}"
+        response = await send_message_cached(
+            instructions,
+            f"Crea un riassunto del seguente testo:\n\n{text}",
+            endpoint="summary",
+            summary_type=summary_type,
+            accuracy_level=accuracy_level
         )
-        
-        response = await chat.send_message(user_message)
         return response
     except Exception as e:
-        logging.error(f"Error generating summary: {e}")
+        logger.exception("Error generating summary")
         raise HTTPException(status_code=500, detail=f"Errore nella generazione del riassunto: {str(e)}")
 
 async def generate_schema_with_gemini(text: str, schema_type: str) -> str:
     try:
-        schema_instructions = {
-            "brainstorming": "Crea una mappa mentale in formato testuale con le idee principali, concetti chiave e collegamenti. Usa simboli, frecce e indentazione per mostrare le relazioni.",
-            "cascata": "Crea uno schema a cascata/flow chart che mostri la sequenza logica, i processi e i collegamenti gerarchici del contenuto. Usa frecce e livelli per mostrare il flusso."
-        }
-        
-        system_message = f"""
-Sei un esperto nella creazione di schemi e mappe mentali. {schema_instructions.get(schema_type, schema_instructions['brainstorming'])}
-
-Lo schema deve:
-- Essere visivamente chiaro e ben strutturato
-- Mostrare tutte le relazioni importanti
-- Usare simboli ASCII per migliorare la leggibilità
-- Essere esportabile e comprensibile
-"""
-        
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message=system_message
-        ).with_model("gemini", "gemini-2.0-flash")
+        instructions = SCHEMA_INSTRUCTIONS.get(schema_type, SCHEMA_INSTRUCTIONS["brainstorming"])
         
-        user_message = UserMessage(
-            text=f"Crea uno schema {schema_type} del seguente contenuto:\n\n{text}"
+        response = await send_message_cached(
+            instructions,
+            f"Crea uno schema {schema_type} del seguente contenuto:\n\n{text}",
+            endpoint="schema",
+            schema_type=schema_type
         )
-        
-        response = await chat.send_message(user_message)
         return response
     except Exception as e:
-        logging.error(f"Error generating schema: {e}")
+        logger.exception("Error generating schema")
         raise HTTPException(status_code=500, detail=f"Errore nella generazione dello schema: {str(e)}")
 
 async def create_pdf_export(content: str, title: str) -> str:
     """Crea un PDF da testo e ritorna il path del file"""
+    # Import locali: reportlab serve solo per l'export e rallenta l'avvio dei worker
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    
     try:
         # Crea file temporaneo
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
@@ -242,57 +618,73 @@ async def create_pdf_export(content: str, title: str) -> str:
                 story.append(Paragraph(para, content_style))
                 story.append(Spacer(1, 6))
         
-        doc.build(story)
         temp_file.close()
+        try:
+            await asyncio.to_thread(doc.build, story)
+        except BaseException:
+            os.unlink(temp_file.name)
+            raise
         
         return temp_file.name
     except Exception as e:
-        logging.error(f"Error creating PDF: {e}")
+        logger.exception("Error creating PDF")
         raise HTTPException(status_code=500, detail=f"Errore nella creazione del PDF: {str(e)}")
 
+async def save_upload_to_tempfile(file: UploadFile, suffix: str) -> Tuple[str, int]:
+    """Copia l'upload in un file temporaneo a blocchi e ritorna (path, dimensione)"""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    temp_file.close()
+    
+    try:
+        file_size = 0
+        async with aiofiles.open(temp_file.name, 'wb') as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail="File troppo grande. Massimo 100MB.")
+                await out.write(chunk)
+    except BaseException:
+        os.unlink(temp_file.name)
+        raise
+    
+    return temp_file.name, file_size
+
 # API Routes
 
 
 @api_router.post("/upload", response_model=dict)
 async def upload_document(file: UploadFile = File(...)):
+    temp_path = None
     try:
-        # Verifica dimensione file (max 100MB)
-        contents = await file.read()
-        if len(contents) > 100 * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="File troppo grande. Massimo 100MB.")
+        # Salva il file su disco a blocchi (max 100MB) senza caricarlo tutto in memoria
+        suffix = '.pdf' if file.content_type == "application/pdf" else '.jpg'
+        temp_path, file_size = await save_upload_to_tempfile(file, suffix)
         
         # Crea documento
         document = DocumentUpload(
             filename=file.filename,
             content_type=file.content_type,
-            file_size=len(contents)
+            file_size=file_size
         )
         
         # Estrai testo
         extracted_text = ""
         
         if file.content_type == "application/pdf":
-            # Prova prima con PyPDF2
-            extracted_text = await extract_text_from_pdf(contents)
+            # Prova prima con PyMuPDF
+            extracted_text = await extract_text_from_pdf(temp_path)
             
-            # Se PyPDF2 non estrae testo (PDF scansionato), usa Gemini
+            # Se PyMuPDF non estrae testo (PDF scansionato), usa Gemini
             if not extracted_text or len(extracted_text.strip()) < 50:
-                # Salva temporaneamente il file per Gemini
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                temp_file.write(contents)
-                temp_file.close()
-                
-                extracted_text = await extract_text_with_gemini(temp_file.name, "application/pdf")
-                os.unlink(temp_file.name)
+                extracted_text = await extract_text_with_gemini(temp_path, "application/pdf")
         
         elif file.content_type.startswith("image/"):
-            # Salva temporaneamente l'immagine per Gemini
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-            temp_file.write(contents)
-            temp_file.close()
+            # Prova prima con l'OCR locale
+            extracted_text = await extract_text_with_ocr(temp_path)
             
-            extracted_text = await extract_text_with_gemini(temp_file.name, file.content_type)
-            os.unlink(temp_file.name)
+            # Se l'OCR non estrae abbastanza testo, usa Gemini
+            if len(extracted_text) < 50:
+                extracted_text = await extract_text_with_gemini(temp_path, file.content_type)
         
         else:
             raise HTTPException(status_code=400, detail="Tipo di file non supportato. Usa PDF o immagini.")
@@ -303,7 +695,7 @@ async def upload_document(file: UploadFile = File(...)):
         document.extracted_text = extracted_text
         
         # Salva nel database
-        document_dict = prepare_for_mongo(document.dict())
+        document_dict = document.model_dump(mode="json")
         result = await db.documents.insert_one(document_dict)
         
         return {
@@ -317,8 +709,11 @@ async def upload_document(file: UploadFile = File(...)):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Upload error: {e}")
+        logger.exception("Upload error")
         raise HTTPException(status_code=500, detail=f"Errore durante il caricamento: {str(e)}")
+    finally:
+        if temp_path:
+            os.unlink(temp_path)
 
 @api_router.post("/generate-summary")
 async def generate_summary(request: SummaryRequest):
@@ -339,7 +734,7 @@ async def generate_summary(request: SummaryRequest):
         )
         
         # Aggiorna documento
-        await db.documents.update_one(
+        await derived_documents.update_one(
             {"id": request.document_id},
             {"$set": {
                 "summary_text": summary,
@@ -358,7 +753,7 @@ async def generate_summary(request: SummaryRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Summary generation error: {e}")
+        logger.exception("Summary generation error")
         raise HTTPException(status_code=500, detail=f"Errore nella generazione del riassunto: {str(e)}")
 
 @api_router.post("/generate-schema")
@@ -379,7 +774,7 @@ async def generate_schema(request: SchemaRequest):
         )
         
         # Aggiorna documento
-        await db.documents.update_one(
+        await derived_documents.update_one(
             {"id": request.document_id},
             {"$set": {
                 "mindmap_schema": schema,
@@ -397,17 +792,17 @@ async def generate_schema(request: SchemaRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Schema generation error: {e}")
+        logger.exception("Schema generation error")
         raise HTTPException(status_code=500, detail=f"Errore nella generazione dello schema: {str(e)}")
 
 @api_router.post("/chat", response_model=dict)
 async def chat_with_document(request: ChatRequest):
     try:
-        system_message = "Sei un assistente AI specializzato nell'aiutare gli utenti con documenti e contenuti. Puoi rispondere a domande, suggerire modifiche, e fornire supporto."
+        system_message = CHAT_SYSTEM_MESSAGE
         
         # Se c'è un document_id, aggiungi il contesto del documento
         if request.document_id:
-            document = await db.documents.find_one({"id": request.document_id})
+            document = await db.documents.find_one({"id": request.document_id}, {"_id": 0, "extracted_text": 1})
             if document and document.get('extracted_text'):
                 system_message += f"\n\nContesto del documento: {document['extracted_text'][:2000]}..."
         
@@ -415,14 +810,12 @@ async def chat_with_document(request: ChatRequest):
         if request.context:
             system_message += f"\n\nContesto aggiuntivo: {request.context}"
         
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message=system_message
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        user_message = UserMessage(text=request.message)
-        response = await chat.send_message(user_message)
+        response = await send_message_cached(
+            system_message,
+            request.message,
+            batchable=False,
+            endpoint="chat"
+        )
         
         # Salva conversazione
         chat_message = ChatMessage(
@@ -431,8 +824,8 @@ async def chat_with_document(request: ChatRequest):
             response=response
         )
         
-        chat_dict = prepare_for_mongo(chat_message.dict())
-        await db.chat_messages.insert_one(chat_dict)
+        # Scrittura differita: l'id è generato lato client, la risposta non attende MongoDB
+        chat_message_writer.submit(chat_message.model_dump(mode="json"))
         
         return {
             "message": request.message,
@@ -441,7 +834,7 @@ async def chat_with_document(request: ChatRequest):
         }
         
     except Exception as e:
-        logging.error(f"Chat error: {e}")
+        logger.exception("Chat error")
         raise HTTPException(status_code=500, detail=f"Errore nella chat: {str(e)}")
 
 @api_router.get("/export-pdf/{document_id}")
@@ -471,34 +864,54 @@ async def export_pdf(document_id: str, content_type: str = "summary"):
         return FileResponse(
             path=pdf_path,
             media_type="application/pdf",
-            filename=f"{title}.pdf"
+            filename=f"{title}.pdf",
+            # Rimuove il file temporaneo dopo l'invio della risposta
+            background=BackgroundTask(os.unlink, pdf_path)
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"PDF export error: {e}")
+        logger.exception("PDF export error")
         raise HTTPException(status_code=500, detail=f"Errore nell'esportazione PDF: {str(e)}")
 
 @api_router.get("/documents")
-async def get_documents():
+async def get_documents(skip: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=1000)):
     try:
-        documents = await db.documents.find().to_list(1000)
+        # Proiezione lato server: niente testo completo, riassunto o schema, solo un'anteprima
+        pipeline = [
+            {"$sort": {"created_at": 1}},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": {
+                "_id": 0,
+                "id": 1,
+                "filename": 1,
+                "content_type": 1,
+                "file_size": 1,
+                "created_at": 1,
+                "has_summary": {"$gt": [{"$strLenCP": {"$ifNull": ["$summary_text", ""]}}, 0]},
+                "has_schema": {"$gt": [{"$strLenCP": {"$ifNull": ["$mindmap_schema", ""]}}, 0]},
+                # $substrCP (non $substrBytes) per non spezzare caratteri multibyte
+                "text_preview": {"$substrCP": [{"$ifNull": ["$extracted_text", ""]}, 0, 200]}
+            }}
+        ]
+        documents = await db.documents.aggregate(pipeline).to_list(length=None)
         return [
             {
                 "id": doc["id"],
                 "filename": doc["filename"],
                 "content_type": doc["content_type"],
                 "file_size": doc["file_size"],
-                "has_summary": bool(doc.get("summary_text")),
-                "has_schema": bool(doc.get("mindmap_schema")),
+                "has_summary": doc["has_summary"],
+                "has_schema": doc["has_schema"],
                 "created_at": doc["created_at"],
-                "text_preview": doc.get("extracted_text", "")[:200] + "..." if doc.get("extracted_text") else None
+                "text_preview": doc["text_preview"] + "..." if doc["text_preview"] else None
             }
             for doc in documents
         ]
     except Exception as e:
-        logging.error(f"Get documents error: {e}")
+        logger.exception("Get documents error")
         raise HTTPException(status_code=500, detail=f"Errore nel recupero documenti: {str(e)}")
 
 @api_router.get("/document/{document_id}")
@@ -524,7 +937,7 @@ async def get_document(document_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Get document error: {e}")
+        logger.exception("Get document error")
         raise HTTPException(status_code=500, detail=f"Errore nel recupero documento: {str(e)}")
 
 # --- NUOVO ENDPOINT DELETE ---
@@ -549,12 +962,16 @@ async def delete_document(document_id: str):
         raise
     except Exception as e:
         # Gestisce altri errori imprevisti
-        logging.error(f"Error deleting document {document_id}: {e}")
+        logger.exception("Error deleting document %s", document_id)
         raise HTTPException(status_code=500, detail=f"Errore durante l'eliminazione: {str(e)}")
 
 # --- FINE NUOVO ENDPOINT DELETE ---
 
 
+@api_router.get("/cache-stats")
+async def cache_stats():
+    return llm_cache.stats()
+
 @api_router.get("/")
 async def root():
     return {"message": "DocBrains API - Analisi Documenti con AI"}
@@ -565,17 +982,43 @@ app.include_router(api_router)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+@app.on_event("startup")
+async def configure_executor():
+    # Thread pool dedicato al lavoro CPU-bound (estrazione PDF, export reportlab)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2))
+
+@app.on_event("startup")
+async def create_indexes():
+    # Tutte le ricerche usano il campo "id" (UUID stringa), non "_id"
+    await db.documents.create_index("id", unique=True)
+    await db.documents.create_index([("created_at", -1)])
+    await db.chat_messages.create_index([("document_id", 1), ("created_at", -1)])
+    await db.llm_cache.create_index("key", unique=True)
+    # TTL index: MongoDB rimuove automaticamente le risposte scadute
+    await db.llm_cache.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL_SECONDS)
+
+@app.on_event("startup")
+async def start_llm_batcher():
+    if LLM_BATCHING_ENABLED:
+        llm_batcher.start()
+
+@app.on_event("startup")
+async def start_chat_message_writer():
+    chat_message_writer.start()
+
+@app.on_event("shutdown")
+async def stop_llm_batcher():
+    await llm_batcher.stop()
+
+@app.on_event("shutdown")
+async def stop_chat_message_writer():
+    await chat_message_writer.stop()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():